@@ -1,8 +1,12 @@
+import io
 import streamlit as st
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
+import pyarrow as pa
+import pyarrow.csv as pacsv
+from matplotlib.figure import Figure
 import seaborn as sns
+from collections import defaultdict, namedtuple
 
 # --- Model Configurations ---
 
@@ -77,45 +81,137 @@ LAKE_PARAMS = {
     'Zinc [µg/l Zn]': {'weight': 0.03485305, 'standard': 5000}
 }
 
+# --- Array Representation of the Models ---
+
+ModelArrays = namedtuple('ModelArrays', ['names', 'weights', 'scales', 'is_ph', 'ph_idx'])
+
+def build_model_arrays(params):
+    """Converts a parameter dictionary into parallel NumPy arrays."""
+    names = tuple(params)
+    weights = np.fromiter((config['weight'] for config in params.values()), dtype=np.float64, count=len(params))
+    # The pH slot has no standard; it gets a dummy 1.0 and is masked out by is_ph.
+    standards = np.fromiter((config.get('standard', 1.0) for config in params.values()), dtype=np.float64, count=len(params))
+    ph_idx = names.index('pH')
+    is_ph = np.zeros(len(params), dtype=bool)
+    is_ph[ph_idx] = True
+    # Reciprocal of each sub-index denominator, times 100, so scoring only multiplies.
+    scales = 100.0 / np.where(is_ph, params['pH']['high'] - 7.0, standards)
+    return ModelArrays(names, weights, scales, is_ph, ph_idx)
+
+_PARAM_DICTS = {
+    "Springs": SPRINGS_PARAMS,
+    "Wells": WELLS_PARAMS,
+    "Lake": LAKE_PARAMS,
+}
+
+@st.cache_resource(max_entries=3)
+def get_model_arrays(water_body):
+    """Returns the array representation of a water body's model, built once per server."""
+    return build_model_arrays(_PARAM_DICTS[water_body])
+
 # --- WQI Calculation Functions ---
 
-def calculate_sub_index(value, param, param_config):
-    """Calculates the sub-index for a given parameter."""
-    if pd.isna(value):
-        return None
-    if param == 'pH':
-        return abs((value - 7) / (param_config['high'] - 7)) * 100
-    else:
-        return (value / param_config['standard']) * 100
-
-def calculate_wqi(data, params):
-    """Calculates the Water Quality Index (WQI)."""
-    wqi = 0
-    total_weight = 0
-    for param, config in params.items():
-        if param in data and not pd.isna(data[param]):
-            sub_index = calculate_sub_index(data[param], param, config)
-            if sub_index is not None:
-                wqi += sub_index * config['weight']
-                total_weight += config['weight']
-    
-    if total_weight == 0:
+# Inclusive upper bound of each class; a WQI of exactly 50 is already 'Good water'.
+_THRESH = np.array([np.nextafter(50.0, -np.inf), 100.0, 200.0, 300.0])
+_LABELS = np.array(['Excellent water', 'Good water', 'Poor water', 'Very poor water', 'Unsuitable for drinking'], dtype=object)
+
+# Inclusive upper bound of each color band of the single sample chart.
+_COLOR_THRESH = np.array([np.nextafter(50.0, -np.inf), 100.0, 300.0])
+_COLORS = ["#2ecc71", "#f1c40f", "#e74c3c", "#c0392b"]
+
+def calculate_wqi_values(values, model):
+    """Calculates the WQI for a 2D array of samples (rows) by parameters (columns)."""
+    # Samples without any measured parameter have no WQI; leave them out of the math.
+    mask = ~np.isnan(values)
+    valid_rows = mask.any(axis=1)
+    wqi = np.full(len(values), np.nan)
+    if not valid_rows.all():
+        values, mask = values[valid_rows], mask[valid_rows]
+
+    # The pH column is blended in through the is_ph mask rather than indexed separately.
+    # Missing values contribute nothing to the weighted sum.
+    sub = np.where(model.is_ph, np.abs(values - 7.0), values) * model.scales
+    wqi[valid_rows] = np.where(mask, sub, 0.0) @ model.weights
+    return wqi
+
+def calculate_wqi(values, model):
+    """Calculates the Water Quality Index (WQI) for one sample ordered as model.names."""
+    wqi = calculate_wqi_values(np.asarray(values, dtype=np.float64).reshape(1, -1), model)[0]
+    if np.isnan(wqi):
         return None, "No valid data provided"
-        
+
     return wqi, classify_wqi(wqi)
 
 def classify_wqi(wqi):
     """Classifies the WQI score."""
-    if wqi < 50:
-        return 'Excellent water'
-    elif wqi <= 100:
-        return 'Good water'
-    elif wqi <= 200:
-        return 'Poor water'
-    elif wqi <= 300:
-        return 'Very poor water'
-    else:
-        return 'Unsuitable for drinking'
+    return classify_wqi_values(np.array([wqi], dtype=np.float64))[0]
+
+def classify_wqi_values(wqi):
+    """Classifies an array of WQI scores."""
+    classes = _LABELS[np.searchsorted(_THRESH, wqi, side='left')]
+    return np.where(np.isnan(wqi), "No valid data provided", classes)
+
+def calculate_wqi_batch(df, model):
+    """Calculates the WQI and class for every row of a DataFrame at once."""
+    # pandas hands back column blocks in Fortran order; the row-wise math wants C order.
+    # Casting and reordering in one np.array call makes a single copy of the block.
+    values = np.array(df.reindex(columns=list(model.names)).to_numpy(copy=False), dtype=np.float64, order='C')
+    wqi = calculate_wqi_values(values, model)
+    return wqi, classify_wqi_values(wqi)
+
+# --- Cached Helpers ---
+
+# Rows parsed and scored at a time. This bounds the parser buffers and the WQI
+# temporaries, not the total: every chunk keeps its input columns for the results
+# table, and joining the chunks copies them once more.
+CSV_CHUNK_ROWS = 200_000
+
+def _read_csv_chunks(raw, water_body):
+    """Parses the uploaded CSV bytes into an iterator of DataFrame chunks."""
+    # Other columns are read as text so every chunk infers the same type for them.
+    dtype_map = defaultdict(lambda: str, {param: 'float64' for param in get_model_arrays(water_body).names})
+    return pd.read_csv(io.BytesIO(raw), engine='c', dtype=dtype_map, chunksize=CSV_CHUNK_ROWS)
+
+@st.cache_data(max_entries=4, ttl=3600, show_spinner="Calculating WQI...")
+def _batch_wqi(raw, water_body):
+    """Calculates the WQI for every sample of an uploaded CSV file."""
+    model = get_model_arrays(water_body)
+    parts = []
+    for chunk in _read_csv_chunks(raw, water_body):
+        missing = {param: np.nan for param in model.names if param not in chunk.columns}
+        wqi, classes = calculate_wqi_batch(chunk, model)
+        parts.append(chunk.assign(**missing, WQI=wqi, Class=classes))
+
+    return pd.concat(parts, ignore_index=True)
+
+@st.cache_data(max_entries=4, ttl=3600)
+def _to_csv_bytes(raw, water_body, _df):
+    """Encodes the batch results of an uploaded CSV file as UTF-8 CSV for download."""
+    # Keyed on the upload bytes, since Streamlit only samples large DataFrames when
+    # hashing; the already computed results are passed unhashed as _df.
+    buf = io.BytesIO()
+    pacsv.write_csv(pa.Table.from_pandas(_df, preserve_index=False), buf)
+    return buf.getvalue()
+
+@st.cache_data
+def _default_inputs(water_body):
+    """Builds the single sample input table with its default values."""
+    names = get_model_arrays(water_body).names
+    return pd.DataFrame({'Parameter': names, 'Value': [7.0 if param == 'pH' else 0.0 for param in names]})
+
+@st.cache_data(max_entries=16)
+def _wqi_figure(wqi, location):
+    """Draws the single sample WQI bar, colored by its quality band, as PNG bytes."""
+    color = _COLORS[np.searchsorted(_COLOR_THRESH, wqi, side='left')]
+    # A standalone Figure stays out of pyplot's global state, which sessions share.
+    fig = Figure(figsize=(6, 4))
+    ax = fig.subplots()
+    sns.barplot(x=[location], y=[wqi], color=color, ax=ax)
+    ax.set_ylim(0, max(350, wqi * 1.2))
+    ax.set_ylabel("WQI Score")
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png', dpi=200, bbox_inches='tight')
+    return buf.getvalue()
 
 # --- Streamlit App ---
 
@@ -151,12 +247,7 @@ with st.sidebar:
     """)
 
 # Parameter selection based on water body
-if water_body == "Springs":
-    PARAMETERS = SPRINGS_PARAMS
-elif water_body == "Wells":
-    PARAMETERS = WELLS_PARAMS
-else:
-    PARAMETERS = LAKE_PARAMS
+MODEL = get_model_arrays(water_body)
 
 # --- Main App Sections (using tabs) ---
 tab1, tab2 = st.tabs(["Single Sample Input", "Batch Processing (CSV Upload)"])
@@ -168,34 +259,31 @@ with tab1:
     with st.form(key='single_sample_form'):
         location = st.text_input("Sample Location (e.g., Plant A)", "Sample_001")
         
-        cols = st.columns(3)
-        data = {}
-        col_index = 0
-        for param, config in PARAMETERS.items():
-            with cols[col_index % 3]:
-                if param == 'pH':
-                    data[param] = st.number_input(label=param, min_value=0.0, max_value=14.0, value=7.0, step=0.1)
-                else:
-                    data[param] = st.number_input(label=param, min_value=0.0, value=0.0, step=0.1)
-            col_index += 1
+        edited = st.data_editor(
+            _default_inputs(water_body),
+            key=f'single_sample_{water_body}',
+            num_rows='fixed',
+            hide_index=True,
+            disabled=['Parameter'],
+            column_config={'Value': st.column_config.NumberColumn(min_value=0.0)},
+        )
             
         submit_button = st.form_submit_button(label='Calculate WQI')
 
     if submit_button:
-        wqi, wqi_class = calculate_wqi(data, PARAMETERS)
-        if wqi is None:
+        values = edited['Value'].to_numpy(dtype=np.float64)
+        wqi, wqi_class = calculate_wqi(values, MODEL)
+        if values[MODEL.ph_idx] > 14.0:
+            st.error("pH must be between 0 and 14.")
+        elif wqi is None:
             st.error(wqi_class)
         else:
             st.success(f"**WQI for {location}**: {wqi:.2f} - **{wqi_class}**")
             
             st.subheader("WQI Visualization")
-            fig, ax = plt.subplots(figsize=(6, 4))
-            sns.barplot(x=[location], y=[wqi], palette=["#2ecc71" if wqi < 50 else "#f1c40f" if wqi <= 100 else "#e74c3c" if wqi <= 300 else "#c0392b"])
-            ax.set_ylim(0, max(350, wqi * 1.2))
-            ax.set_ylabel("WQI Score")
-            st.pyplot(fig)
+            st.image(_wqi_figure(wqi, location))
 
-            result_df = pd.DataFrame({'Location': [location], 'WQI': [wqi], 'Class': [wqi_class], **data})
+            result_df = pd.DataFrame({'Location': [location], 'WQI': [wqi], 'Class': [wqi_class], **dict(zip(MODEL.names, values))})
             csv = result_df.to_csv(index=False).encode('utf-8')
             st.download_button(label="Download Results as CSV", data=csv, file_name=f'wqi_{location}.csv', mime='text/csv')
 
@@ -205,27 +293,16 @@ with tab2:
     uploaded_file = st.file_uploader("Upload a CSV file", type=["csv"])
 
     if uploaded_file is not None:
-        df = pd.read_csv(uploaded_file)
-        
-        for param in PARAMETERS.keys():
-            if param not in df.columns:
-                df[param] = np.nan
-
-        results = df.apply(lambda row: calculate_wqi(row, PARAMETERS), axis=1, result_type='expand')
-        df[['WQI', 'Class']] = results
+        raw = uploaded_file.getvalue()
+        df = _batch_wqi(raw, water_body)
 
         st.write("### Batch Results")
         st.dataframe(df)
 
         st.write("### WQI Distribution for Batch")
-        fig, ax = plt.subplots(figsize=(12, 6))
-        sns.barplot(data=df, x=df.index, y='WQI', hue='Class', dodge=False)
-        plt.xticks(rotation=45)
-        ax.set_ylim(0, max(350, df['WQI'].max() * 1.2))
-        st.pyplot(fig)
+        st.bar_chart(df, y='WQI', color='Class', height=400)
         
-        csv = df.to_csv(index=False).encode('utf-8')
-        st.download_button(label="Download Batch Results as CSV", data=csv, file_name='wqi_batch_results.csv', mime='text/csv')
+        st.download_button(label="Download Batch Results as CSV", data=_to_csv_bytes(raw, water_body, df), file_name='wqi_batch_results.csv', mime='text/csv')
 
 # --- FOOTER WITH PARTNER LOGOS ---
 st.markdown("---")